@@ -0,0 +1,228 @@
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue
+from typing import Any, Callable
+from task_model import Task
+import database_manager as db_manager
+
+# Primary result codes, the extended codes share the low byte.
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+
+
+def is_busy_error(error: sqlite3.Error) -> bool:
+    """
+    Tell whether an error means another connection holds the lock ("database is locked")
+    :param error: error raised by sqlite3
+    :return: True if the operation may succeed when retried
+    """
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (SQLITE_BUSY, SQLITE_LOCKED)
+    message = str(error)
+    return "database is locked" in message or "database table is locked" in message
+
+
+class ConcurrentTaskStore:
+    """
+    Thread-safe access to the tasks database.
+
+    The database runs in WAL mode so readers never block the writer. Every thread
+    reads through its own connection, while all writes of this process are handed to
+    a single writer thread. Writers in other processes are waited for with
+    busy_timeout, then retried with exponential backoff; once max_retries is
+    exhausted the sqlite3 error is raised instead of being turned into None/False.
+    A separate archive file given as archive_db_file is attached on every connection.
+    """
+
+    def __init__(self, db_file_name: str = "tasks.db", busy_timeout_ms: int = 5000, max_retries: int = 8,
+                 backoff_base: float = 0.01, backoff_max: float = 1.0, archive_db_file: str | None = None):
+        self.db_file_name = db_file_name
+        self.archive_db_file = archive_db_file
+        self.busy_timeout_ms = busy_timeout_ms
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._local = threading.local()
+        self._reader_connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._write_queue: Queue = Queue()
+        # Guards _closed together with the queue, so no write can be queued behind the stop sentinel.
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+        self._writer_conn = self._connect()
+        self._run_with_retry(self._writer_conn, self._setup_database)
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="task-db-writer", daemon=True)
+        self._writer_thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Each connection is only used by one thread, but close() runs on the caller's thread.
+        conn = sqlite3.connect(self.db_file_name, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        if self.archive_db_file is not None:
+            # ATTACH takes no lock; the writer creates the archive table in _setup_database.
+            conn.execute(f"ATTACH DATABASE ? AS {db_manager.ARCHIVE_SCHEMA}", (self.archive_db_file,))
+        return conn
+
+    def _setup_database(self, conn: sqlite3.Connection) -> None:
+        # Runs under _run_with_retry: every statement here may hit a lock held by another process.
+        db_manager.create_table(conn, raise_errors=True)
+        if self.archive_db_file is not None:
+            db_manager.attach_archive(conn, self.archive_db_file, raise_errors=True)
+        conn.commit()
+        # journal_mode applies to the archive file too and is persistent, so this covers connections opened later and by other processes.
+        conn.execute("PRAGMA journal_mode = WAL")
+        # WAL makes an fsync per checkpoint rather than per commit sufficient for the writer.
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+    def _reader_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._reader_connections.append(conn)
+        return conn
+
+    def _run_with_retry(self, conn: sqlite3.Connection, operation: Callable[..., Any], *args) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return operation(conn, *args)
+            except sqlite3.Error as e:
+                if not is_busy_error(e) or attempt >= self.max_retries:
+                    raise
+                # Drop whatever the failed attempt left behind so the retry starts clean.
+                if conn.in_transaction:
+                    conn.rollback()
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                attempt += 1
+
+    def _writer_loop(self) -> None:
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            future, operation, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run_with_retry(self._writer_conn, operation, *args))
+            except BaseException as e:
+                future.set_exception(e)
+        self._writer_conn.close()
+
+    def submit_write(self, operation: Callable[..., Any], *args) -> Future:
+        """
+        Queue a write for the writer thread
+        :param operation: function called as operation(conn, *args); must commit its own changes
+        and raise sqlite3 errors so busy errors can be retried
+        :return: Future holding the result of operation
+        """
+        future = Future()
+        with self._write_lock:
+            if self._closed:
+                raise RuntimeError("ConcurrentTaskStore is closed")
+            self._write_queue.put((future, operation, args))
+        return future
+
+    def read(self, operation: Callable[..., Any], *args) -> Any:
+        """
+        Run a read on the calling thread's own connection
+        :param operation: function called as operation(conn, *args); must raise sqlite3 errors
+        :return: result of operation
+        """
+        if self._closed:
+            raise RuntimeError("ConcurrentTaskStore is closed")
+        return self._run_with_retry(self._reader_connection(), operation, *args)
+
+    def add_task(self, task: Task) -> int:
+        """
+        Add a new task into the Tasks table
+        :param task: Task object
+        :return: task id
+        """
+        return self.submit_write(lambda conn: db_manager.add_task(conn, task, raise_errors=True)).result()
+
+    def update_task(self, task: Task) -> bool:
+        """
+        Update a task
+        :param task: Task object
+        :return: True if updated, False if no task has that id
+        """
+        return self.submit_write(lambda conn: db_manager.update_task(conn, task, raise_errors=True)).result()
+
+    def delete_task(self, task_id: int) -> bool:
+        """
+        Delete a task by task id
+        :param task_id: id of the task
+        :return: True if deleted, False if no task has that id
+        """
+        return self.submit_write(lambda conn: db_manager.delete_task(conn, task_id, raise_errors=True)).result()
+
+    def get_task(self, task_id: int, include_archive: bool = False) -> Task | None:
+        """
+        Query tasks by id
+        :param task_id:
+        :param include_archive: also look the task up in the archive
+        :return: Task object or None
+        """
+        return self.read(lambda conn: db_manager.get_task(conn, task_id, include_archive, raise_errors=True))
+
+    def get_all_tasks(self, include_archive: bool = False) -> list[Task]:
+        """
+        Query all rows in the Tasks table
+        :param include_archive: also return archived tasks
+        :return: A list of Task objects
+        """
+        return self.read(lambda conn: db_manager.get_all_tasks(conn, include_archive, raise_errors=True))
+
+    def archive_tasks(self, cutoff_date: str, batch_size: int = 1000) -> int:
+        """
+        Move tasks created before cutoff_date into the archive. Each batch is a separate write,
+        so other writes are not held up behind the whole run.
+        :param cutoff_date: ISO format date, tasks with an earlier creation_date are archived
+        :param batch_size: number of tasks moved per transaction
+        :return: number of tasks archived
+        """
+        archived = 0
+        while True:
+            moved = self.submit_write(lambda conn: db_manager.archive_tasks(
+                conn, cutoff_date, batch_size, max_batches=1, raise_errors=True)).result()
+            if moved == 0:
+                return archived
+            archived += moved
+
+    def compact_database(self) -> bool:
+        """
+        Reclaim free pages in the database file and the archive file
+        :return: True if compacted
+        """
+        return self.submit_write(lambda conn: db_manager.compact_database(conn, raise_errors=True)).result()
+
+    def close(self) -> None:
+        """Finish the queued writes, then close the writer and all reader connections"""
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._write_queue.put(None)
+        self._writer_thread.join()
+        with self._connections_lock:
+            for conn in self._reader_connections:
+                conn.close()
+            self._reader_connections.clear()
+
+    def __enter__(self) -> "ConcurrentTaskStore":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
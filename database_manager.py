@@ -1,22 +1,34 @@
 import sqlite3
 from sqlite3 import Error
 from task_model import Task # Assuming task_model.py is in the same directory
+import duplicate_detector
 
-def create_connection(db_file_name: str = "tasks.db") -> sqlite3.Connection | None:
-    """Create a database connection to an SQLite database specified by db_file_name"""
+TASK_COLUMNS = "id, title, description, duration, creation_date, repetition, priority, category"
+ARCHIVE_SCHEMA = "archive"
+
+def create_connection(db_file_name: str = "tasks.db",
+                      archive_db_file: str | None = None) -> sqlite3.Connection | None:
+    """Create a database connection to an SQLite database specified by db_file_name
+    :param archive_db_file: separate archive database file to attach; an attachment only lives as
+        long as its connection, so every connection to a database with an archive file needs it
+    """
     conn = None
     try:
         conn = sqlite3.connect(db_file_name)
         print(f"SQLite version: {sqlite3.sqlite_version}")
         print(f"Successfully connected to {db_file_name}")
+        if archive_db_file is not None and not attach_archive(conn, archive_db_file):
+            conn.close()
+            return None
         return conn
     except Error as e:
         print(f"Error connecting to database: {e}")
         return None
 
-def create_table(conn: sqlite3.Connection) -> None:
+def create_table(conn: sqlite3.Connection, raise_errors: bool = False) -> None:
     """Create a table from the create_table_sql statement
     :param conn: Connection object
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
     """
     create_table_sql = """CREATE TABLE IF NOT EXISTS Tasks (
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,16 +42,84 @@ def create_table(conn: sqlite3.Connection) -> None:
                         );"""
     try:
         cursor = conn.cursor()
+        # Only takes effect on a new database; compact_database converts existing files.
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
         cursor.execute(create_table_sql)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_creation_date ON Tasks(creation_date)")
+        _create_archive_table(conn, "main")
+        duplicate_detector.create_index_table(conn, raise_errors=True)
         print("Tasks table created successfully (if it didn't exist).")
     except Error as e:
+        if raise_errors:
+            raise
         print(f"Error creating table: {e}")
 
-def add_task(conn: sqlite3.Connection, task: Task) -> int | None:
+def _create_archive_table(conn: sqlite3.Connection, schema: str) -> None:
+    # Same columns as Tasks, but ids are copied over instead of generated.
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {schema}.TasksArchive (
+                        id INTEGER PRIMARY KEY,
+                        title TEXT NOT NULL,
+                        description TEXT,
+                        duration INTEGER,
+                        creation_date TEXT NOT NULL,
+                        repetition TEXT,
+                        priority INTEGER,
+                        category TEXT
+                    );""")
+
+def _archive_tables(conn: sqlite3.Connection) -> list[str]:
+    # Every archive table visible on this connection: the main file's, then the attached archive file's.
+    # Tasks archived before the archive file was attached stay in the main file.
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list")]
+    tables = ["main.TasksArchive"]
+    if ARCHIVE_SCHEMA in schemas:
+        tables.append(f"{ARCHIVE_SCHEMA}.TasksArchive")
+    return tables
+
+def _archive_table(conn: sqlite3.Connection) -> str:
+    # Tasks are archived into the attached archive file if there is one, else into the main file.
+    return _archive_tables(conn)[-1]
+
+def _row_to_task(row: tuple) -> Task:
+    return Task(id=row[0], title=row[1], description=row[2], duration=row[3],
+                creation_date=row[4], repetition=row[5], priority=row[6], category=row[7])
+
+def _reclaim_free_pages(conn: sqlite3.Connection, schema: str = "main") -> None:
+    # Hand freed pages back to the filesystem (no-op unless auto_vacuum is incremental).
+    # executescript steps the pragma to completion; execute() would free a single page.
+    conn.executescript(f"PRAGMA {schema}.incremental_vacuum;")
+
+def attach_archive(conn: sqlite3.Connection, archive_db_file: str, raise_errors: bool = False) -> bool:
+    """
+    Attach a separate archive database file. Once attached, archive_tasks moves tasks
+    into it and queries with include_archive=True read from it as well as from the
+    archive table in the main file. The attachment is per connection; prefer passing
+    archive_db_file to create_connection so no connection is opened without it.
+    :param conn: Connection object
+    :param archive_db_file: path of the archive database file, created if missing
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
+    :return: True if attached, False otherwise
+    """
+    try:
+        # Skip the ATTACH when retrying after a busy error left the file attached.
+        if ARCHIVE_SCHEMA not in [row[1] for row in conn.execute("PRAGMA database_list")]:
+            conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_db_file,))
+        conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.auto_vacuum = INCREMENTAL")
+        _create_archive_table(conn, ARCHIVE_SCHEMA)
+        conn.commit()
+        return True
+    except Error as e:
+        if raise_errors:
+            raise
+        print(f"Error attaching archive database: {e}")
+        return False
+
+def add_task(conn: sqlite3.Connection, task: Task, raise_errors: bool = False) -> int | None:
     """
     Add a new task into the Tasks table
     :param conn: Connection object
     :param task: Task object
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
     :return: task id
     """
     sql = '''INSERT INTO Tasks(title, description, duration, creation_date, repetition, priority, category)
@@ -48,56 +128,83 @@ def add_task(conn: sqlite3.Connection, task: Task) -> int | None:
         cursor = conn.cursor()
         cursor.execute(sql, (task.title, task.description, task.duration, task.creation_date,
                            task.repetition, task.priority, task.category))
+        task_id = cursor.lastrowid
+        duplicate_detector.index_task(conn, Task(id=task_id, title=task.title, description=task.description,
+                                                 duration=task.duration, creation_date=task.creation_date,
+                                                 repetition=task.repetition, priority=task.priority,
+                                                 category=task.category))
         conn.commit()
-        return cursor.lastrowid
+        return task_id
     except Error as e:
+        conn.rollback()
+        if raise_errors:
+            raise
         print(f"Error adding task: {e}")
         return None
 
-def get_task(conn: sqlite3.Connection, task_id: int) -> Task | None:
+def get_task(conn: sqlite3.Connection, task_id: int, include_archive: bool = False,
+             raise_errors: bool = False) -> Task | None:
     """
     Query tasks by id
     :param conn: the Connection object
     :param task_id:
+    :param include_archive: also look the task up in the archive
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
     :return: Task object or None
     """
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Tasks WHERE id=?", (task_id,))
+        cursor.execute(f"SELECT {TASK_COLUMNS} FROM Tasks WHERE id=?", (task_id,))
         row = cursor.fetchone()
+        if row is None and include_archive:
+            for archive_table in _archive_tables(conn):
+                cursor.execute(f"SELECT {TASK_COLUMNS} FROM {archive_table} WHERE id=?", (task_id,))
+                row = cursor.fetchone()
+                if row:
+                    break
         if row:
-            return Task(id=row[0], title=row[1], description=row[2], duration=row[3],
-                        creation_date=row[4], repetition=row[5], priority=row[6], category=row[7])
+            return _row_to_task(row)
         else:
             return None
     except Error as e:
+        if raise_errors:
+            raise
         print(f"Error getting task: {e}")
         return None
 
-def get_all_tasks(conn: sqlite3.Connection) -> list[Task]:
+def get_all_tasks(conn: sqlite3.Connection, include_archive: bool = False,
+                  raise_errors: bool = False) -> list[Task]:
     """
     Query all rows in the Tasks table
     :param conn: the Connection object
+    :param include_archive: also return archived tasks, which come first
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
     :return: A list of Task objects
     """
     tasks_list = []
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Tasks")
+        if include_archive:
+            cursor.execute(" UNION ALL ".join(f"SELECT {TASK_COLUMNS} FROM {table}"
+                                              for table in _archive_tables(conn) + ["main.Tasks"]))
+        else:
+            cursor.execute(f"SELECT {TASK_COLUMNS} FROM Tasks")
         rows = cursor.fetchall()
         for row in rows:
-            tasks_list.append(Task(id=row[0], title=row[1], description=row[2], duration=row[3],
-                                   creation_date=row[4], repetition=row[5], priority=row[6], category=row[7]))
+            tasks_list.append(_row_to_task(row))
         return tasks_list
     except Error as e:
+        if raise_errors:
+            raise
         print(f"Error getting all tasks: {e}")
         return []
 
-def update_task(conn: sqlite3.Connection, task: Task) -> bool:
+def update_task(conn: sqlite3.Connection, task: Task, raise_errors: bool = False) -> bool:
     """
     update title, description, duration, creation_date, repetition, priority, and category of a task
     :param conn:
     :param task:
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
     :return: True if updated, False otherwise
     """
     sql = '''UPDATE Tasks
@@ -113,29 +220,114 @@ def update_task(conn: sqlite3.Connection, task: Task) -> bool:
         cursor = conn.cursor()
         cursor.execute(sql, (task.title, task.description, task.duration, task.creation_date,
                            task.repetition, task.priority, task.category, task.id))
+        updated = cursor.rowcount > 0
+        if updated:
+            duplicate_detector.index_task(conn, task)
         conn.commit()
-        return cursor.rowcount > 0
+        return updated
     except Error as e:
+        conn.rollback()
+        if raise_errors:
+            raise
         print(f"Error updating task: {e}")
         return False
 
-def delete_task(conn: sqlite3.Connection, task_id: int) -> bool:
+def delete_task(conn: sqlite3.Connection, task_id: int, raise_errors: bool = False) -> bool:
     """
     Delete a task by task id
     :param conn: Connection to the SQLite database
     :param task_id: id of the task
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
     :return: True if deleted, False otherwise
     """
     sql = 'DELETE FROM Tasks WHERE id=?'
     try:
         cursor = conn.cursor()
         cursor.execute(sql, (task_id,))
+        deleted = cursor.rowcount > 0
+        duplicate_detector.unindex_task(conn, task_id)
         conn.commit()
-        return cursor.rowcount > 0
+        return deleted
     except Error as e:
+        conn.rollback()
+        if raise_errors:
+            raise
         print(f"Error deleting task: {e}")
         return False
 
+def archive_tasks(conn: sqlite3.Connection, cutoff_date: str, batch_size: int = 1000,
+                  max_batches: int | None = None, raise_errors: bool = False) -> int:
+    """
+    Move tasks created before cutoff_date from Tasks into the archive, one batch per transaction,
+    then reclaim the freed space. Space freed by delete_task is only reclaimed here or by compact_database.
+    A task whose id is already in the archive fails the batch, which is rolled back, instead of
+    overwriting the archived row.
+    With an attached archive file in WAL mode (as set up by ConcurrentTaskStore), a batch is not
+    atomic across the two files: a crash during commit can leave it applied to only one of them.
+    :param conn: Connection object
+    :param cutoff_date: ISO format date, tasks with an earlier creation_date are archived
+    :param batch_size: number of tasks moved per transaction
+    :param max_batches: stop after this many batches, None to archive every task before the cutoff
+    :param raise_errors: re-raise sqlite3 errors instead of printing them; batches committed
+        before the error stay archived
+    :return: number of tasks archived
+    """
+    archived = 0
+    batches = 0
+    batch_sql = "SELECT id FROM Tasks WHERE creation_date < ? ORDER BY creation_date, id LIMIT ?"
+    try:
+        archive_table = _archive_table(conn)
+        cursor = conn.cursor()
+        while max_batches is None or batches < max_batches:
+            cursor.execute(f"INSERT INTO {archive_table}({TASK_COLUMNS}) "
+                           f"SELECT {TASK_COLUMNS} FROM Tasks WHERE id IN ({batch_sql})",
+                           (cutoff_date, batch_size))
+            if cursor.rowcount <= 0:
+                conn.rollback()
+                break
+            cursor.execute(f"DELETE FROM TaskSimilarity WHERE task_id IN ({batch_sql})", (cutoff_date, batch_size))
+            cursor.execute(f"DELETE FROM Tasks WHERE id IN ({batch_sql})", (cutoff_date, batch_size))
+            archived += cursor.rowcount
+            batches += 1
+            conn.commit()
+    except Error as e:
+        conn.rollback()
+        if raise_errors:
+            raise
+        print(f"Error archiving tasks: {e}")
+    if archived:
+        # Best effort: the archived batches are committed whether or not this succeeds.
+        try:
+            _reclaim_free_pages(conn)
+        except Error as e:
+            print(f"Error reclaiming free pages: {e}")
+    return archived
+
+def compact_database(conn: sqlite3.Connection, raise_errors: bool = False) -> bool:
+    """
+    Reclaim free pages in the database file (and the attached archive file, if any).
+    A database created before auto_vacuum was enabled is rebuilt once with VACUUM.
+    :param conn: Connection object
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
+    :return: True if compacted, False otherwise
+    """
+    try:
+        conn.commit()  # VACUUM cannot run inside a transaction
+        cursor = conn.cursor()
+        schemas = [row[1] for row in cursor.execute("PRAGMA database_list") if row[1] != "temp"]
+        for schema in schemas:
+            # auto_vacuum 2 is INCREMENTAL
+            if cursor.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+                cursor.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+                cursor.execute(f"VACUUM {schema}")
+            _reclaim_free_pages(conn, schema)
+        return True
+    except Error as e:
+        if raise_errors:
+            raise
+        print(f"Error compacting database: {e}")
+        return False
+
 if __name__ == '__main__':
     db_name = "tasks_main.db"
     # Create a database connection
@@ -0,0 +1,376 @@
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from sqlite3 import Error
+from task_model import Task
+
+# MinHash / LSH parameters. NUM_BANDS * ROWS_PER_BAND hash functions are applied
+# to the trigram set of every task; two tasks with Jaccard similarity s become
+# candidates with probability 1 - (1 - s**ROWS_PER_BAND) ** NUM_BANDS. With 20
+# bands of 5 rows that curve is steep around the default threshold: ~0.3% at
+# s=0.2, ~80% at s=0.6 and ~97.5% at s=0.7.
+NUM_BANDS = 20
+ROWS_PER_BAND = 5
+DEFAULT_THRESHOLD = 0.6
+# Buckets with more members than this only pair each task with the
+# MAX_BUCKET_SIZE - 1 tasks that follow it (by id), which keeps the number of
+# candidate pairs linear in the number of tasks.
+MAX_BUCKET_SIZE = 100
+
+_NUM_HASHES = NUM_BANDS * ROWS_PER_BAND
+# Stay well below SQLite's limit on host parameters.
+_MAX_QUERY_PARAMS = 900
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def create_index_table(conn: sqlite3.Connection, raise_errors: bool = False) -> None:
+    """
+    Create the TaskSimilarity table holding the LSH buckets of every task.
+    Tasks stored before the table existed are not indexed; run backfill_index once for them.
+    :param conn: Connection object
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""CREATE TABLE IF NOT EXISTS TaskSimilarity (
+                            task_id INTEGER NOT NULL,
+                            band INTEGER NOT NULL,
+                            bucket INTEGER NOT NULL
+                        );""")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_similarity_bucket ON TaskSimilarity(band, bucket)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_similarity_task ON TaskSimilarity(task_id)")
+    except Error as e:
+        if raise_errors:
+            raise
+        print(f"Error creating similarity index table: {e}")
+
+
+def trigrams(text: str) -> set[str]:
+    """
+    Split text into its set of character trigrams after normalising case and punctuation
+    :param text: title and description of a task
+    :return: set of trigrams
+    """
+    normalized = " ".join(_NON_ALNUM.sub(" ", text.lower()).split())
+    if not normalized:
+        return set()
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _chunks(ids: list[int]):
+    for start in range(0, len(ids), _MAX_QUERY_PARAMS):
+        yield ids[start:start + _MAX_QUERY_PARAMS]
+
+
+def _task_text(title: str, description: str | None) -> str:
+    return f"{title} {description or ''}"
+
+
+def jaccard(grams_a: set[str], grams_b: set[str]) -> float:
+    """
+    Jaccard similarity of two trigram sets
+    :return: value between 0.0 and 1.0
+    """
+    if not grams_a or not grams_b:
+        return 0.0
+    intersection = len(grams_a & grams_b)
+    return intersection / (len(grams_a) + len(grams_b) - intersection)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _gram_hashes(gram: str) -> array:
+    # _NUM_HASHES independent 32-bit hashes of a trigram. shake_128 is deterministic,
+    # so buckets persisted by one process stay valid in every other process and run.
+    return array("I", hashlib.shake_128(gram.encode("utf-8")).digest(4 * _NUM_HASHES))
+
+
+def band_buckets(title: str, description: str | None, category: str | None) -> list[int]:
+    """
+    Compute the LSH bucket of every band for a task.
+    The category is part of the bucket key, so only tasks in the same category can collide.
+    :return: one bucket per band
+    """
+    grams = trigrams(_task_text(title, description))
+    if not grams:
+        return []
+    signature = array("I", map(min, zip(*map(_gram_hashes, grams))))
+    category_key = (category or "").encode("utf-8")
+    buckets = []
+    for band in range(NUM_BANDS):
+        digest = hashlib.blake2b(category_key, digest_size=8)
+        digest.update(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes())
+        buckets.append(int.from_bytes(digest.digest(), "little", signed=True))
+    return buckets
+
+
+def _bucket_rows(rows: list[tuple]) -> list[tuple[int, int, int]]:
+    # Worker for rebuild_index: rows are (id, title, description, category).
+    index_rows = []
+    for task_id, title, description, category in rows:
+        for band, bucket in enumerate(band_buckets(title, description, category)):
+            index_rows.append((task_id, band, bucket))
+    return index_rows
+
+
+def _bucket_pairs(ids: list[int], max_bucket_size: int):
+    # Candidate pairs of one bucket; ids are sorted. Oversized buckets are compared
+    # through a sliding window instead of all against all.
+    window = len(ids) if len(ids) <= max_bucket_size else max_bucket_size - 1
+    for i, a in enumerate(ids):
+        for b in ids[i + 1:i + 1 + window]:
+            yield a, b
+
+
+def _bucket_pair_count(size: int, max_bucket_size: int) -> int:
+    if size <= max_bucket_size:
+        return size * (size - 1) // 2
+    window = max_bucket_size - 1
+    return (size - window) * window + window * (window - 1) // 2
+
+
+def _verify_buckets(args: tuple[list[list[int]], dict[int, str], float, int]) -> list[tuple[int, int]]:
+    # Worker for find_duplicate_clusters: expand the buckets into candidate pairs and
+    # keep the ones above the threshold.
+    buckets, texts, threshold, max_bucket_size = args
+    grams = {}
+    seen = set()
+    matches = []
+    for ids in buckets:
+        for a, b in _bucket_pairs(ids, max_bucket_size):
+            if (a, b) in seen:
+                continue
+            seen.add((a, b))
+            if a not in grams:
+                grams[a] = trigrams(texts[a])
+            if b not in grams:
+                grams[b] = trigrams(texts[b])
+            if jaccard(grams[a], grams[b]) >= threshold:
+                matches.append((a, b))
+    return matches
+
+
+def index_task(conn: sqlite3.Connection, task: Task) -> None:
+    """
+    Insert or refresh the LSH buckets of a single task. Does not commit, so it can
+    share the transaction of the insert/update that triggered it.
+    :param conn: Connection object
+    :param task: Task object with a valid id
+    """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM TaskSimilarity WHERE task_id=?", (task.id,))
+    cursor.executemany("INSERT INTO TaskSimilarity(task_id, band, bucket) VALUES(?,?,?)",
+                       [(task.id, band, bucket) for band, bucket in
+                        enumerate(band_buckets(task.title, task.description, task.category))])
+
+
+def unindex_task(conn: sqlite3.Connection, task_id: int) -> None:
+    """
+    Remove the LSH buckets of a task. Does not commit.
+    :param conn: Connection object
+    :param task_id: id of the task
+    """
+    conn.execute("DELETE FROM TaskSimilarity WHERE task_id=?", (task_id,))
+
+
+def rebuild_index(conn: sqlite3.Connection, workers: int | None = None, batch_size: int = 10000,
+                  raise_errors: bool = False) -> int:
+    """
+    Recompute the similarity index for all tasks, spreading the hashing over several processes.
+    The hashing happens before anything is written, so the write transaction only covers
+    replacing the index rows. Tasks added meanwhile keep the index rows add_task gave them;
+    a task updated meanwhile may keep the buckets of its old text until it is updated again.
+    :param conn: Connection object
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param batch_size: number of tasks handed to a worker at a time
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
+    :return: number of tasks indexed, or -1 on error
+    """
+    workers = workers or os.cpu_count() or 1
+    indexed = 0
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, title, description, category FROM Tasks ORDER BY id")
+        batches = list(iter(lambda: cursor.fetchmany(batch_size), []))
+        if workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_bucket_rows, batches))
+        else:
+            results = [_bucket_rows(batch) for batch in batches]
+        # Ids are AUTOINCREMENT, so tasks added since the SELECT all have larger ids.
+        max_id = batches[-1][-1][0] if batches else 0
+        cursor.execute("DELETE FROM TaskSimilarity WHERE task_id <= ?", (max_id,))
+        for batch, index_rows in zip(batches, results):
+            cursor.executemany("INSERT INTO TaskSimilarity(task_id, band, bucket) VALUES(?,?,?)", index_rows)
+            indexed += len(batch)
+        conn.commit()
+        return indexed
+    except Error as e:
+        conn.rollback()
+        if raise_errors:
+            raise
+        print(f"Error rebuilding similarity index: {e}")
+        return -1
+
+
+def backfill_index(conn: sqlite3.Connection, workers: int | None = None, raise_errors: bool = False) -> int:
+    """
+    Index the tasks of a database that predates the similarity index. Run once after upgrading;
+    it does nothing when the index already has entries or there are no tasks.
+    :param conn: Connection object
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param raise_errors: re-raise sqlite3 errors instead of printing them
+    :return: number of tasks indexed, or -1 on error
+    """
+    try:
+        cursor = conn.cursor()
+        if (cursor.execute("SELECT EXISTS(SELECT 1 FROM TaskSimilarity)").fetchone()[0]
+                or not cursor.execute("SELECT EXISTS(SELECT 1 FROM Tasks)").fetchone()[0]):
+            return 0
+    except Error as e:
+        if raise_errors:
+            raise
+        print(f"Error checking similarity index: {e}")
+        return -1
+    return rebuild_index(conn, workers, raise_errors=raise_errors)
+
+
+def _candidate_buckets(conn: sqlite3.Connection) -> list[list[int]]:
+    # Sorted task ids of every bucket shared by more than one task.
+    cursor = conn.cursor()
+    cursor.execute("""SELECT group_concat(task_id) FROM TaskSimilarity
+                      GROUP BY band, bucket HAVING COUNT(*) > 1""")
+    return [sorted(int(task_id) for task_id in members.split(",")) for (members,) in cursor]
+
+
+def count_candidate_pairs(conn: sqlite3.Connection, max_bucket_size: int = MAX_BUCKET_SIZE) -> int:
+    """
+    Count the candidate pairs find_duplicate_clusters would verify (a pair sharing several
+    bands is counted once per band)
+    :param conn: Connection object
+    :param max_bucket_size: see find_duplicate_clusters
+    :return: number of candidate pairs, or -1 on error
+    """
+    try:
+        return sum(_bucket_pair_count(len(ids), max_bucket_size) for ids in _candidate_buckets(conn))
+    except Error as e:
+        print(f"Error counting candidate pairs: {e}")
+        return -1
+
+
+def find_duplicate_clusters(conn: sqlite3.Connection, threshold: float = DEFAULT_THRESHOLD,
+                            workers: int | None = None, batch_size: int = 50000,
+                            max_bucket_size: int = MAX_BUCKET_SIZE) -> list[list[int]]:
+    """
+    Find clusters of likely duplicate tasks in the same category
+    :param conn: Connection object
+    :param threshold: minimum trigram Jaccard similarity of title and description
+    :param workers: number of worker processes used to verify candidates, defaults to the number of CPUs
+    :param batch_size: approximate number of candidate pairs handed to a worker at a time
+    :param max_bucket_size: buckets larger than this only pair each task with the
+        max_bucket_size - 1 tasks following it, so the work stays linear in the number of tasks
+    :return: list of clusters, each a sorted list of task ids (lowest id first)
+    """
+    workers = workers or os.cpu_count() or 1
+    try:
+        buckets = _candidate_buckets(conn)
+        if not buckets:
+            return []
+
+        candidate_ids = sorted({task_id for ids in buckets for task_id in ids})
+        texts = {}
+        cursor = conn.cursor()
+        for chunk in _chunks(candidate_ids):
+            cursor.execute(f"SELECT id, title, description FROM Tasks WHERE id IN ({','.join('?' * len(chunk))})",
+                           chunk)
+            for task_id, title, description in cursor.fetchall():
+                texts[task_id] = _task_text(title, description)
+    except Error as e:
+        print(f"Error finding duplicate tasks: {e}")
+        return []
+
+    # Pairs are only generated inside the workers; the jobs carry whole buckets.
+    jobs = []
+    job_buckets, job_pairs = [], 0
+    for ids in buckets:
+        ids = [task_id for task_id in ids if task_id in texts]
+        if len(ids) < 2:
+            continue
+        job_buckets.append(ids)
+        job_pairs += _bucket_pair_count(len(ids), max_bucket_size)
+        if job_pairs >= batch_size:
+            jobs.append(job_buckets)
+            job_buckets, job_pairs = [], 0
+    if job_buckets:
+        jobs.append(job_buckets)
+    jobs = [(job, {task_id: texts[task_id] for ids in job for task_id in ids}, threshold, max_bucket_size)
+            for job in jobs]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_verify_buckets, jobs))
+    else:
+        results = [_verify_buckets(job) for job in jobs]
+
+    # Union-find over the verified pairs.
+    parent = {}
+
+    def find(task_id):
+        parent.setdefault(task_id, task_id)
+        while parent[task_id] != task_id:
+            parent[task_id] = parent[parent[task_id]]
+            task_id = parent[task_id]
+        return task_id
+
+    for matches in results:
+        for a, b in matches:
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters = {}
+    for task_id in parent:
+        clusters.setdefault(find(task_id), []).append(task_id)
+    return sorted(sorted(cluster) for cluster in clusters.values())
+
+
+def merge_duplicates(conn: sqlite3.Connection, clusters: list[list[int]]) -> int:
+    """
+    Merge every cluster into its first task: the first task is kept and takes the highest
+    priority found in its cluster, the other tasks are deleted.
+    All clusters are merged in a single transaction.
+    :param conn: Connection object
+    :param clusters: clusters as returned by find_duplicate_clusters
+    :return: number of tasks removed, or -1 on error
+    """
+    removed = 0
+    try:
+        cursor = conn.cursor()
+        for cluster in clusters:
+            keep_id, duplicate_ids = cluster[0], list(cluster[1:])
+            if not duplicate_ids:
+                continue
+            priorities = []
+            for chunk in _chunks(duplicate_ids):
+                cursor.execute(f"SELECT MAX(priority) FROM Tasks WHERE id IN ({','.join('?' * len(chunk))})",
+                               chunk)
+                priorities.append(cursor.fetchone()[0])
+            priorities = [priority for priority in priorities if priority is not None]
+            if priorities:
+                cursor.execute("UPDATE Tasks SET priority = ? WHERE id = ? AND (priority IS NULL OR priority < ?)",
+                               (max(priorities), keep_id, max(priorities)))
+            for chunk in _chunks(duplicate_ids):
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"DELETE FROM TaskSimilarity WHERE task_id IN ({placeholders})", chunk)
+                cursor.execute(f"DELETE FROM Tasks WHERE id IN ({placeholders})", chunk)
+                removed += cursor.rowcount
+        conn.commit()
+        return removed
+    except Error as e:
+        conn.rollback()
+        print(f"Error merging duplicate tasks: {e}")
+        return -1
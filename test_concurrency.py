@@ -0,0 +1,275 @@
+import unittest
+import os
+import sqlite3
+import threading
+import time
+import multiprocessing
+from functools import partial
+from unittest import mock
+from task_model import Task
+from concurrent_access import ConcurrentTaskStore
+import database_manager as db_manager
+
+WRITER_COUNTS = (1, 2, 4, 8)
+TASKS_PER_WRITER = 100
+
+
+def _make_task(title: str) -> Task:
+    return Task(id=0, title=title, description="Stress test", duration=5,
+                creation_date="2024-01-01T12:00:00", repetition="None", priority=1, category="Stress")
+
+
+def _process_writer(db_file: str, writer_index: int, count: int) -> None:
+    # Runs in a child process, each with its own store and therefore its own writer thread.
+    with ConcurrentTaskStore(db_file) as store:
+        for i in range(count):
+            store.add_task(_make_task(f"writer {writer_index} task {i}"))
+
+
+class _FlakyCommitConnection(sqlite3.Connection):
+    # Fails the next commit the way a contended database does, without committing.
+    fail_next_commit = False
+
+    def commit(self):
+        if self.fail_next_commit:
+            self.fail_next_commit = False
+            raise sqlite3.OperationalError("database is locked")
+        super().commit()
+
+
+class TestConcurrentTaskStore(unittest.TestCase):
+    def setUp(self):
+        """Set up for test methods."""
+        self.db_file = "test_concurrency.db"
+        self._remove_db_files()
+
+    def tearDown(self):
+        """Tear down after test methods."""
+        self._remove_db_files()
+
+    def _remove_db_files(self, db_file=None):
+        db_file = db_file or self.db_file
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+
+    def _expected_titles(self, writers):
+        return {f"writer {w} task {i}" for w in range(writers) for i in range(TASKS_PER_WRITER)}
+
+    def _stored_titles(self):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return [row[0] for row in conn.execute("SELECT title FROM Tasks")]
+        finally:
+            conn.close()
+
+    def _report(self, kind, writers, elapsed):
+        throughput = writers * TASKS_PER_WRITER / elapsed
+        print(f"{kind}: {writers} writer(s), {writers * TASKS_PER_WRITER} tasks in {elapsed:.2f}s "
+              f"({throughput:.0f} writes/s)")
+
+    def test_threaded_writers_lose_no_writes(self):
+        """Test that concurrent writer threads, with readers running alongside, lose no writes."""
+        for writers in WRITER_COUNTS:
+            with self.subTest(writers=writers):
+                self._remove_db_files()
+                reader_errors = []
+                stop_reading = threading.Event()
+                with ConcurrentTaskStore(self.db_file) as store:
+                    def write(writer_index):
+                        for i in range(TASKS_PER_WRITER):
+                            store.add_task(_make_task(f"writer {writer_index} task {i}"))
+
+                    def read():
+                        try:
+                            while not stop_reading.is_set():
+                                store.get_all_tasks()
+                        except sqlite3.Error as e:
+                            reader_errors.append(e)
+
+                    readers = [threading.Thread(target=read) for _ in range(2)]
+                    threads = [threading.Thread(target=write, args=(w,)) for w in range(writers)]
+                    for reader in readers:
+                        reader.start()
+                    start = time.perf_counter()
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    elapsed = time.perf_counter() - start
+                    stop_reading.set()
+                    for reader in readers:
+                        reader.join()
+                    self.assertEqual(len(store.get_all_tasks()), writers * TASKS_PER_WRITER)
+
+                self.assertEqual(reader_errors, [])
+                titles = self._stored_titles()
+                self.assertEqual(len(titles), writers * TASKS_PER_WRITER)
+                self.assertEqual(set(titles), self._expected_titles(writers))
+                self._report("threads", writers, elapsed)
+
+    def test_multiprocess_writers_lose_no_writes(self):
+        """Test that writers in separate processes contending for the same file lose no writes."""
+        context = multiprocessing.get_context("spawn")
+        for writers in WRITER_COUNTS:
+            with self.subTest(writers=writers):
+                self._remove_db_files()
+                # Create the schema up front so the processes only contend on inserts.
+                ConcurrentTaskStore(self.db_file).close()
+                processes = [context.Process(target=_process_writer, args=(self.db_file, w, TASKS_PER_WRITER))
+                             for w in range(writers)]
+                start = time.perf_counter()
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+                elapsed = time.perf_counter() - start
+
+                self.assertEqual([process.exitcode for process in processes], [0] * writers)
+                titles = self._stored_titles()
+                self.assertEqual(len(titles), writers * TASKS_PER_WRITER)
+                self.assertEqual(set(titles), self._expected_titles(writers))
+                self._report("processes", writers, elapsed)
+
+    def test_multiprocess_writers_create_fresh_database(self):
+        """Test that processes opening a brand-new file at the same time all set it up and lose no writes."""
+        context = multiprocessing.get_context("spawn")
+        writers = 4
+        processes = [context.Process(target=_process_writer, args=(self.db_file, w, TASKS_PER_WRITER))
+                     for w in range(writers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self.assertEqual([process.exitcode for process in processes], [0] * writers)
+        titles = self._stored_titles()
+        self.assertEqual(len(titles), writers * TASKS_PER_WRITER)
+        self.assertEqual(set(titles), self._expected_titles(writers))
+
+    def test_setup_busy_error_is_retried(self):
+        """Test that a locked database during schema setup is retried rather than swallowed."""
+        blocker = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+        blocker.execute("BEGIN EXCLUSIVE")
+        release = threading.Timer(0.3, blocker.execute, args=("COMMIT",))
+        release.start()
+        try:
+            store = ConcurrentTaskStore(self.db_file, busy_timeout_ms=20, max_retries=20)
+        finally:
+            release.join()
+            blocker.close()
+        with store:
+            self.assertIsNotNone(store.add_task(_make_task("After setup")))
+
+    def test_write_racing_close_never_hangs(self):
+        """Test that a write submitted while the store closes is either run or refused, never stranded."""
+        store = ConcurrentTaskStore(self.db_file)
+        queue_put = store._write_queue.put
+        submitting = threading.Event()
+
+        def slow_put(item):
+            # Widen the window between the closed check and the put for writes, not the stop sentinel.
+            if item is not None:
+                submitting.set()
+                time.sleep(0.2)
+            queue_put(item)
+
+        store._write_queue.put = slow_put
+        outcome = []
+
+        def write():
+            try:
+                outcome.append(store.submit_write(lambda conn: "done").result(timeout=5))
+            except RuntimeError:
+                outcome.append("refused")
+            except TimeoutError:
+                outcome.append("stranded")
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        submitting.wait(timeout=5)
+        store.close()
+        thread.join()
+        self.assertIn(outcome, (["done"], ["refused"]))
+
+    def test_delete_retried_after_busy_commit(self):
+        """Test that a delete whose commit hits a busy error is retried and still reports success."""
+        with mock.patch("sqlite3.connect", partial(sqlite3.connect, factory=_FlakyCommitConnection)):
+            store = ConcurrentTaskStore(self.db_file)
+        with store:
+            task_id = store.add_task(_make_task("Delete me"))
+            store._writer_conn.fail_next_commit = True
+            self.assertTrue(store.delete_task(task_id))
+            self.assertFalse(store._writer_conn.fail_next_commit)
+            self.assertIsNone(store.get_task(task_id))
+
+    def test_delete_does_no_work_after_commit(self):
+        """Test that delete_task ends with its commit, so retrying it after a busy error is safe."""
+        conn = sqlite3.connect(self.db_file)
+        try:
+            db_manager.create_table(conn)
+            task_id = db_manager.add_task(conn, _make_task("Delete me"))
+            statements = []
+            conn.set_trace_callback(statements.append)
+            self.assertTrue(db_manager.delete_task(conn, task_id))
+            self.assertEqual(statements[-1], "COMMIT")
+        finally:
+            conn.close()
+
+    def test_archive_visible_to_every_reader(self):
+        """Test that tasks archived to a separate file through the store are seen by all reader threads."""
+        archive_file = "test_concurrency_archive.db"
+        self._remove_db_files(archive_file)
+        self.addCleanup(self._remove_db_files, archive_file)
+        with ConcurrentTaskStore(self.db_file, archive_db_file=archive_file) as store:
+            old_task = _make_task("Old")
+            old_task.creation_date = "2023-01-01T09:00:00"
+            old_id = store.add_task(old_task)
+            store.add_task(_make_task("New"))
+            self.assertEqual(store.archive_tasks("2024-01-01T00:00:00", batch_size=1), 1)
+            self.assertTrue(store.compact_database())
+
+            results = []
+            reader = threading.Thread(target=lambda: results.append(
+                (store.get_task(old_id, include_archive=True), len(store.get_all_tasks(include_archive=True)))))
+            reader.start()
+            reader.join()
+            self.assertEqual(results[0][0].title, "Old")
+            self.assertEqual(results[0][1], 2)
+            self.assertEqual(len(store.get_all_tasks()), 1)
+
+        conn = sqlite3.connect(archive_file)
+        try:
+            self.assertEqual(conn.execute("SELECT id FROM TasksArchive").fetchall(), [(old_id,)])
+        finally:
+            conn.close()
+
+    def test_write_retried_until_lock_released(self):
+        """Test that a write blocked by another connection's lock is retried and succeeds."""
+        with ConcurrentTaskStore(self.db_file, busy_timeout_ms=20, max_retries=20) as store:
+            blocker = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+            blocker.execute("BEGIN EXCLUSIVE")
+            release = threading.Timer(0.3, blocker.execute, args=("COMMIT",))
+            release.start()
+            try:
+                task_id = store.add_task(_make_task("Blocked task"))
+            finally:
+                release.join()
+                blocker.close()
+            self.assertIsNotNone(store.get_task(task_id))
+
+    def test_write_raises_when_lock_never_released(self):
+        """Test that a busy database surfaces an error instead of returning None."""
+        with ConcurrentTaskStore(self.db_file, busy_timeout_ms=10, max_retries=2, backoff_base=0.001) as store:
+            blocker = sqlite3.connect(self.db_file, isolation_level=None)
+            blocker.execute("BEGIN EXCLUSIVE")
+            try:
+                with self.assertRaises(sqlite3.OperationalError):
+                    store.add_task(_make_task("Blocked task"))
+            finally:
+                blocker.execute("COMMIT")
+                blocker.close()
+            self.assertEqual(store.get_all_tasks(), [])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,8 +1,12 @@
 import unittest
 import os
+import random
+import sqlite3
+from unittest import mock
 from datetime import datetime # Needed for task creation
 from task_model import Task
 import database_manager as db_manager
+import duplicate_detector
 
 class TestTaskManager(unittest.TestCase):
     def setUp(self):
@@ -38,6 +42,11 @@ class TestTaskManager(unittest.TestCase):
              return Task(id=0, title=title, description=description, duration=duration,
                         creation_date=creation_date, repetition=repetition, priority=priority, category=category)
 
+    def _add_dated_task(self, title, creation_date):
+        task = self._create_sample_task_obj(title=title)
+        task.creation_date = creation_date
+        return db_manager.add_task(self.conn, task)
+
 
     def test_task_model_creation(self):
         """Test Task model object creation and attribute assignment."""
@@ -135,5 +144,263 @@ class TestTaskManager(unittest.TestCase):
         delete_success = db_manager.delete_task(self.conn, 999)
         self.assertFalse(delete_success, "Deleting a non-existent task should return False")
 
+    def test_find_duplicate_clusters(self):
+        """Test that near-duplicate tasks in the same category are clustered together."""
+        grocery_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Grocery shopping", category="Home"))
+        groceries_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Groceries shopping", category="Home"))
+        db_manager.add_task(self.conn, self._create_sample_task_obj(title="Grocery shopping", category="Work"))
+        db_manager.add_task(self.conn, self._create_sample_task_obj(title="Pay electricity bill", category="Home"))
+
+        clusters = duplicate_detector.find_duplicate_clusters(self.conn, workers=1)
+        self.assertEqual(clusters, [[grocery_id, groceries_id]])
+
+    def test_duplicate_index_follows_updates_and_deletes(self):
+        """Test that the similarity index is kept in sync by update_task and delete_task."""
+        first_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Water the plants"))
+        second_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Renew passport"))
+        self.assertEqual(duplicate_detector.find_duplicate_clusters(self.conn, workers=1), [])
+
+        db_manager.update_task(self.conn, self._create_sample_task_obj(id=second_id, title="Water the plant"))
+        self.assertEqual(duplicate_detector.find_duplicate_clusters(self.conn, workers=1), [[first_id, second_id]])
+
+        db_manager.delete_task(self.conn, first_id)
+        self.assertEqual(duplicate_detector.find_duplicate_clusters(self.conn, workers=1), [])
+
+    def test_rebuild_index_and_merge_duplicates(self):
+        """Test rebuilding the similarity index and merging the clusters it finds."""
+        kept_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Grocery shopping"))
+        db_manager.add_task(self.conn, self._create_sample_task_obj(title="Groceries shopping"))
+        db_manager.add_task(self.conn, self._create_sample_task_obj(title="Grocery  shopping!"))
+        other_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Book dentist appointment"))
+        self.conn.execute("DELETE FROM TaskSimilarity")
+        self.conn.commit()
+
+        self.assertEqual(duplicate_detector.rebuild_index(self.conn, workers=2, batch_size=2), 4)
+        clusters = duplicate_detector.find_duplicate_clusters(self.conn, workers=1)
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(len(clusters[0]), 3)
+
+        removed = duplicate_detector.merge_duplicates(self.conn, clusters)
+        self.assertEqual(removed, 2)
+        remaining_ids = [task.id for task in db_manager.get_all_tasks(self.conn)]
+        self.assertEqual(remaining_ids, [kept_id, other_id])
+        self.assertEqual(duplicate_detector.find_duplicate_clusters(self.conn, workers=1), [])
+
+    def test_merge_duplicates_keeps_highest_priority(self):
+        """Test that the kept task of a merged cluster takes the highest priority of the cluster."""
+        kept_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Grocery shopping", priority=1))
+        high_id = db_manager.add_task(self.conn, self._create_sample_task_obj(title="Groceries shopping", priority=3))
+
+        self.assertEqual(duplicate_detector.merge_duplicates(self.conn, [[kept_id, high_id]]), 1)
+        self.assertEqual(db_manager.get_task(self.conn, kept_id).priority, 3)
+        self.assertIsNone(db_manager.get_task(self.conn, high_id))
+
+    def test_merge_duplicates_large_cluster(self):
+        """Test that a cluster larger than SQLite's host-parameter limit is merged."""
+        # Builds differ in their limit; use the historic default of 999.
+        self.conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        self.conn.executemany(
+            "INSERT INTO Tasks(title, description, duration, creation_date, repetition, priority, category) "
+            "VALUES(?,?,?,?,?,?,?)",
+            [("Buy milk", "", 5, "2024-01-01T12:00:00", "None", 2, "Home")] * 2000)
+        self.conn.commit()
+        cluster = [row[0] for row in self.conn.execute("SELECT id FROM Tasks ORDER BY id")]
+
+        self.assertEqual(duplicate_detector.merge_duplicates(self.conn, [cluster]), 1999)
+        self.assertEqual([task.id for task in db_manager.get_all_tasks(self.conn)], [cluster[0]])
+
+    def test_backfill_index_for_existing_database(self):
+        """Test that backfill_index indexes tasks stored before the similarity index existed."""
+        db_manager.add_task(self.conn, self._create_sample_task_obj(title="Grocery shopping"))
+        db_manager.add_task(self.conn, self._create_sample_task_obj(title="Groceries shopping"))
+        self.conn.execute("DROP TABLE TaskSimilarity")
+        self.conn.commit()
+
+        db_manager.create_table(self.conn)
+        self.assertEqual(duplicate_detector.find_duplicate_clusters(self.conn, workers=1), [])
+        self.assertEqual(duplicate_detector.backfill_index(self.conn, workers=1), 2)
+        self.assertEqual(len(duplicate_detector.find_duplicate_clusters(self.conn, workers=1)), 1)
+        self.assertEqual(duplicate_detector.backfill_index(self.conn, workers=1), 0)
+
+    def test_rebuild_index_hashes_outside_the_write_transaction(self):
+        """Test that rebuild_index hashes with no transaction open and keeps tasks added meanwhile."""
+        db_manager.add_task(self.conn, self._create_sample_task_obj(title="Grocery shopping"))
+        bucket_rows = duplicate_detector._bucket_rows
+
+        def add_task_then_hash(rows):
+            self.assertFalse(self.conn.in_transaction, "no write transaction may be open while hashing")
+            db_manager.add_task(self.conn, self._create_sample_task_obj(title="Groceries shopping"))
+            return bucket_rows(rows)
+
+        with mock.patch.object(duplicate_detector, "_bucket_rows", add_task_then_hash):
+            self.assertEqual(duplicate_detector.rebuild_index(self.conn, workers=1), 1)
+        self.assertEqual(len(duplicate_detector.find_duplicate_clusters(self.conn, workers=1)), 1)
+
+    def test_oversized_bucket_still_clustered(self):
+        """Test that tasks in a bucket larger than max_bucket_size still end up in one cluster."""
+        task_ids = [db_manager.add_task(self.conn, self._create_sample_task_obj(title="Take out the trash"))
+                    for _ in range(30)]
+        clusters = duplicate_detector.find_duplicate_clusters(self.conn, workers=1, max_bucket_size=5)
+        self.assertEqual(clusters, [task_ids])
+
+    def test_candidate_pairs_grow_linearly(self):
+        """Test that capping bucket sizes keeps the candidate pairs linear in the number of tasks."""
+        words = ["buy", "milk", "call", "mom", "pay", "rent", "clean", "kitchen",
+                 "walk", "dog", "book", "flight", "fix", "sink", "read", "news"]
+        max_bucket_size = 5
+
+        def candidate_pairs(task_count):
+            # Only 240 distinct titles in one category, so buckets fill up quickly.
+            rng = random.Random(7)
+            self.conn.execute("DELETE FROM Tasks")
+            self.conn.executemany(
+                "INSERT INTO Tasks(title, description, duration, creation_date, repetition, priority, category) "
+                "VALUES(?,?,?,?,?,?,?)",
+                [(" ".join(rng.sample(words, 2)), "", 60, "2024-01-01T12:00:00", "Daily", 1, "Home")
+                 for _ in range(task_count)])
+            self.conn.commit()
+            duplicate_detector.rebuild_index(self.conn, workers=1)
+            return (duplicate_detector.count_candidate_pairs(self.conn, max_bucket_size),
+                    duplicate_detector.count_candidate_pairs(self.conn, task_count))
+
+        capped_small, uncapped_small = candidate_pairs(2000)
+        capped_large, uncapped_large = candidate_pairs(4000)
+        print(f"candidate pairs: 2000 tasks -> {capped_small} (uncapped {uncapped_small}), "
+              f"4000 tasks -> {capped_large} (uncapped {uncapped_large})")
+        self.assertLessEqual(capped_large, 4000 * duplicate_detector.NUM_BANDS * (max_bucket_size - 1))
+        self.assertLess(capped_large / capped_small, 3)
+        self.assertGreater(uncapped_large / uncapped_small, 3.5)
+
+    def test_archive_tasks(self):
+        """Test that tasks older than the cutoff are moved to the archive in batches."""
+        old_ids = [self._add_dated_task(f"Old {i}", f"2023-0{i + 1}-01T09:00:00") for i in range(5)]
+        new_id = self._add_dated_task("New", "2024-06-01T09:00:00")
+
+        archived = db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00", batch_size=2)
+        self.assertEqual(archived, 5)
+        self.assertEqual([task.id for task in db_manager.get_all_tasks(self.conn)], [new_id])
+        self.assertIsNone(db_manager.get_task(self.conn, old_ids[0]))
+
+        archived_task = db_manager.get_task(self.conn, old_ids[0], include_archive=True)
+        self.assertIsNotNone(archived_task)
+        self.assertEqual(archived_task.title, "Old 0")
+        all_ids = [task.id for task in db_manager.get_all_tasks(self.conn, include_archive=True)]
+        self.assertEqual(all_ids, old_ids + [new_id])
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00"), 0)
+
+    def test_archive_tasks_to_separate_file(self):
+        """Test archiving into an attached archive database file."""
+        archive_file = "test_tasks_archive.db"
+        if os.path.exists(archive_file):
+            os.remove(archive_file)
+        self.addCleanup(lambda: os.path.exists(archive_file) and os.remove(archive_file))
+        old_id = self._add_dated_task("Old", "2023-01-01T09:00:00")
+        self._add_dated_task("New", "2024-06-01T09:00:00")
+
+        self.assertTrue(db_manager.attach_archive(self.conn, archive_file))
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00"), 1)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM main.TasksArchive").fetchone()[0], 0)
+        self.assertEqual(self.conn.execute("SELECT id FROM archive.TasksArchive").fetchall(), [(old_id,)])
+        self.assertEqual(len(db_manager.get_all_tasks(self.conn, include_archive=True)), 2)
+
+    def test_archive_file_attached_by_create_connection(self):
+        """Test that a new connection opened with archive_db_file sees tasks archived to that file."""
+        archive_file = "test_tasks_archive.db"
+        if os.path.exists(archive_file):
+            os.remove(archive_file)
+        self.addCleanup(lambda: os.path.exists(archive_file) and os.remove(archive_file))
+        self.conn.close()
+        self.conn = db_manager.create_connection(self.db_file, archive_db_file=archive_file)
+        self.assertIsNotNone(self.conn)
+        old_id = self._add_dated_task("Old", "2023-01-01T09:00:00")
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00"), 1)
+
+        other_conn = db_manager.create_connection(self.db_file, archive_db_file=archive_file)
+        self.addCleanup(other_conn.close)
+        self.assertEqual(db_manager.get_task(other_conn, old_id, include_archive=True).title, "Old")
+        self.assertEqual(len(db_manager.get_all_tasks(other_conn, include_archive=True)), 1)
+
+    def test_archive_then_attach_archive_file(self):
+        """Test that tasks archived before an archive file was attached are still returned."""
+        archive_file = "test_tasks_archive.db"
+        if os.path.exists(archive_file):
+            os.remove(archive_file)
+        self.addCleanup(lambda: os.path.exists(archive_file) and os.remove(archive_file))
+        first_id = self._add_dated_task("Archived in main", "2022-01-01T09:00:00")
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2023-01-01T00:00:00"), 1)
+        second_id = self._add_dated_task("Archived in file", "2023-06-01T09:00:00")
+
+        self.assertTrue(db_manager.attach_archive(self.conn, archive_file))
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00"), 1)
+        all_ids = [task.id for task in db_manager.get_all_tasks(self.conn, include_archive=True)]
+        self.assertEqual(all_ids, [first_id, second_id])
+        self.assertEqual(db_manager.get_task(self.conn, first_id, include_archive=True).title, "Archived in main")
+        self.assertEqual(db_manager.get_task(self.conn, second_id, include_archive=True).title, "Archived in file")
+
+    def test_archive_tasks_max_batches(self):
+        """Test that archive_tasks stops after max_batches batches."""
+        for i in range(5):
+            self._add_dated_task(f"Old {i}", f"2023-0{i + 1}-01T09:00:00")
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00", batch_size=2, max_batches=1), 2)
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00", batch_size=2), 3)
+
+    def test_archive_errors_raised_on_request(self):
+        """Test that archive_tasks reports a failed batch instead of returning a partial count."""
+        task_id = self._add_dated_task("Old", "2023-01-01T09:00:00")
+        self.conn.execute("INSERT INTO TasksArchive(id, title, creation_date) VALUES(?, 'Archived', '2022-01-01')",
+                          (task_id,))
+        self.conn.commit()
+        with self.assertRaises(sqlite3.IntegrityError):
+            db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00", raise_errors=True)
+        self.assertIsNotNone(db_manager.get_task(self.conn, task_id))
+
+    def test_archive_does_not_overwrite_archived_task(self):
+        """Test that an id clash with the archive rolls the batch back instead of replacing the row."""
+        task_id = self._add_dated_task("Old", "2023-01-01T09:00:00")
+        self.conn.execute("INSERT INTO TasksArchive(id, title, creation_date) VALUES(?, 'Archived', '2022-01-01')",
+                          (task_id,))
+        self.conn.commit()
+
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00"), 0)
+        self.assertEqual(db_manager.get_task(self.conn, task_id).title, "Old")
+        self.assertEqual(self.conn.execute("SELECT title FROM TasksArchive").fetchall(), [("Archived",)])
+
+    def test_archive_reclaims_space(self):
+        """Test that archiving leaves no free pages behind in the database file."""
+        description = "x" * 2000
+        for i in range(200):
+            task = self._create_sample_task_obj(title=f"Task {i}", description=description)
+            task.creation_date = "2023-01-01T09:00:00"
+            db_manager.add_task(self.conn, task)
+        self.assertTrue(db_manager.attach_archive(self.conn, ":memory:"))
+        pages_before = self.conn.execute("PRAGMA page_count").fetchone()[0]
+
+        self.assertEqual(db_manager.archive_tasks(self.conn, "2024-01-01T00:00:00", batch_size=50), 200)
+        self.assertEqual(self.conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+        self.assertLess(self.conn.execute("PRAGMA page_count").fetchone()[0], pages_before)
+
+    def test_delete_leaves_reclaiming_to_compact_database(self):
+        """Test that space freed by delete_task is handed back by compact_database."""
+        task_ids = [db_manager.add_task(self.conn, self._create_sample_task_obj(description="x" * 2000))
+                    for _ in range(50)]
+        for task_id in task_ids:
+            self.assertTrue(db_manager.delete_task(self.conn, task_id))
+        self.assertGreater(self.conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+        self.assertTrue(db_manager.compact_database(self.conn))
+        self.assertEqual(self.conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+    def test_compact_database_converts_existing_file(self):
+        """Test that compact_database enables incremental auto_vacuum on an older database file."""
+        self.conn.close()
+        os.remove(self.db_file)
+        self.conn = db_manager.create_connection(self.db_file)
+        self.conn.execute("CREATE TABLE Tasks (id INTEGER PRIMARY KEY)")
+        self.conn.commit()
+        self.assertEqual(self.conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+
+        self.assertTrue(db_manager.compact_database(self.conn))
+        self.assertEqual(self.conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)